@@ -3,13 +3,15 @@ Stock Market Data API
 A RESTful API for accessing stock market data stored in PostgreSQL.
 """
 import os
+import json
+from datetime import datetime, timedelta, timezone
 from flask import Flask, request
 from flask_restx import Api, Resource, fields
 from flask_cors import CORS
 from prometheus_flask_exporter import PrometheusMetrics
 import redis
 from .database import get_db_connection, close_db_connection
-from .models import get_stock_data, get_stock_symbols, get_stock_data_by_date_range
+from .models import get_stock_data, get_stock_symbols, get_stock_data_by_date_range, get_stock_bars, BAR_SOURCES, BAR_SECONDS
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -170,6 +172,72 @@ class StockHistory(Resource):
         
         return data
 
+def parse_bar_time(value, default):
+    """Parse an ISO 8601 date or datetime query parameter as UTC"""
+    if value is None:
+        return default
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+@ns_stocks.route('/<string:symbol>/bars')
+@api.doc(params={
+    'symbol': 'The stock symbol',
+    'interval': 'Bar interval: 1m, 5m or 1d (default 1d)',
+    'start': 'Inclusive start, ISO 8601 date or datetime (default: end minus 1 day, or 30 days for 1d)',
+    'end': 'Exclusive end, ISO 8601 date or datetime (default: now, rounded down to the bar boundary). 1d bounds are widened to whole UTC days',
+    'limit': 'Maximum number of bars (default 5000, max 50000)'
+})
+class StockBars(Resource):
+    @endpoints_counter
+    @api.doc('get_stock_bars')
+    def get(self, symbol):
+        """Get OHLCV bars for a symbol at a given interval in columnar form"""
+        interval = request.args.get('interval', '1d')
+        if interval not in BAR_SOURCES:
+            api.abort(400, f"Unsupported interval {interval}, expected one of {', '.join(BAR_SOURCES)}")
+        limit = min(max(request.args.get('limit', 5000, type=int), 1), 50000)
+        
+        # Round the default end down to a bar boundary so it yields a stable cache key
+        step = BAR_SECONDS[interval]
+        now = datetime.fromtimestamp(int(datetime.now(timezone.utc).timestamp()) // step * step, timezone.utc)
+        
+        try:
+            end = parse_bar_time(request.args.get('end'), now)
+            default_span = timedelta(days=30 if interval == '1d' else 1)
+            start = parse_bar_time(request.args.get('start'), end - default_span)
+        except ValueError:
+            api.abort(400, "start and end must be ISO 8601 dates or datetimes")
+        
+        # Check cache first
+        cache_key = f"stocks:bars:{symbol}:{interval}:{start.isoformat()}:{end.isoformat()}:{limit}"
+        cached_data = redis_client.get(cache_key)
+        
+        if cached_data:
+            return json.loads(cached_data)
+        
+        # Get data from database, one bar past the page to detect a next page
+        conn = get_db_connection()
+        bars = get_stock_bars(conn, symbol, interval, start, end, limit + 1)
+        close_db_connection(conn)
+        
+        if bars is None:
+            api.abort(500, f"Failed to load {interval} bars for {symbol}")
+        
+        has_more = len(bars['t']) > limit
+        result = {'symbol': symbol, 'interval': interval}
+        result.update({name: values[:limit] for name, values in bars.items()})
+        # Resume from the first bar past this page. The cursor is naive UTC so
+        # it can be passed back unencoded (no '+' offset)
+        if has_more:
+            result['next_start'] = datetime.utcfromtimestamp(bars['t'][limit]).isoformat()
+        
+        # Cache intraday results for 1 minute, daily results for 10 minutes
+        redis_client.setex(cache_key, 600 if interval == '1d' else 60, json.dumps(result))
+        
+        return result
+
 @app.route('/health')
 def health():
     """Health check endpoint"""
@@ -2,7 +2,22 @@
 Database models and query functions for the Stock Market Data API.
 """
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
+
+# Bar storage per interval: table name and time column. Intraday intervals
+# live in the partitioned stock_bars_* tables, daily bars in stock_data.
+BAR_SOURCES = {
+    '1m': ('stock_bars_1m', 'ts'),
+    '5m': ('stock_bars_5m', 'ts'),
+    '1d': ('stock_data', 'date'),
+}
+
+# Length of one bar in seconds per interval
+BAR_SECONDS = {
+    '1m': 60,
+    '5m': 300,
+    '1d': 86400,
+}
 
 def get_stock_data(conn, symbol=None, page=1, per_page=100):
     """
@@ -140,4 +155,55 @@ def get_stock_statistics(conn, symbol):
             return dict(result) if result else None
     except Exception as e:
         logging.error(f"Database error in get_stock_statistics: {e}")
-        return None
\ No newline at end of file
+        return None
+
+def get_stock_bars(conn, symbol, interval, start, end, limit=5000):
+    """
+    Get OHLCV bars for a symbol at the given interval in columnar form.
+    
+    Args:
+        conn: Database connection
+        symbol: Stock symbol
+        interval: Bar interval, one of BAR_SOURCES
+        start: Inclusive start as a timezone-aware datetime
+        end: Exclusive end as a timezone-aware datetime
+        limit: Maximum number of bars to return
+    
+    For 1d the bounds are widened to whole UTC days: start is truncated to
+    its day and a non-midnight end is rounded up to the next day.
+    
+    Returns:
+        Dictionary of parallel lists keyed by column, with 't' holding epoch
+        seconds, or None on error
+    """
+    table, column = BAR_SOURCES[interval]
+    if column == 'date':
+        # Compare on the column's own type so the (symbol, date) index is used
+        start = start.astimezone(timezone.utc)
+        end = end.astimezone(timezone.utc)
+        end_date = end.date()
+        if end.time() != datetime.min.time():
+            end_date += timedelta(days=1)
+        start, end = start.date(), end_date
+    
+    try:
+        with conn.cursor() as cur:
+            query = f"""
+                SELECT
+                    EXTRACT(EPOCH FROM {column})::bigint AS t,
+                    open, high, low, close, volume
+                FROM {table}
+                WHERE symbol = %s AND {column} >= %s AND {column} < %s
+                ORDER BY {column}
+                LIMIT %s
+            """
+            cur.execute(query, (symbol, start, end, limit))
+            results = cur.fetchall()
+            bars = {'t': [row['t'] for row in results], 'volume': [row['volume'] for row in results]}
+            for name in ('open', 'high', 'low', 'close'):
+                # Daily prices are NUMERIC and come back as Decimal
+                bars[name] = [None if row[name] is None else float(row[name]) for row in results]
+            return bars
+    except Exception as e:
+        logging.error(f"Database error in get_stock_bars: {e}")
+        return None
@@ -3,7 +3,7 @@ Airflow DAG for fetching stock market data and storing it in PostgreSQL.
 """
 from datetime import datetime, timedelta
 from airflow import DAG
-from airflow.operators.python import PythonOperator
+from airflow.operators.python import PythonOperator, ShortCircuitOperator
 from airflow.operators.bash import BashOperator
 from airflow.providers.postgres.operators.postgres import PostgresOperator
 import sys
@@ -14,6 +14,8 @@ sys.path.append('/opt/airflow/scripts')
 
 # Import the fetch_stock_data script
 from fetch_stock_data import main as fetch_stock_data_main
+from fetch_stock_data import maintenance_main as intraday_maintenance_main
+from fetch_stock_data import setup_intraday_main
 
 # Default arguments for the DAG
 default_args = {
@@ -77,4 +79,58 @@ log_completion = BashOperator(
 )
 
 # Define task dependencies
-create_tables >> fetch_stock_data >> log_completion
\ No newline at end of file
+create_tables >> fetch_stock_data >> log_completion
+
+# Create the intraday DAG
+intraday_dag = DAG(
+    'stock_intraday_pipeline',
+    default_args=default_args,
+    description='A DAG to fetch and bulk load intraday stock bars',
+    schedule_interval='*/15 * * * *',  # Run every 15 minutes
+    catchup=False,
+    max_active_runs=1,
+    tags=['stock', 'data', 'pipeline', 'intraday'],
+)
+
+# Task to ensure the intraday tables exist; skips all DDL once they do
+create_intraday_tables = PythonOperator(
+    task_id='create_intraday_tables',
+    python_callable=setup_intraday_main,
+    dag=intraday_dag,
+)
+
+# Tasks to fetch and bulk load 1m and 5m bars
+fetch_intraday_1m = PythonOperator(
+    task_id='fetch_intraday_1m',
+    python_callable=fetch_stock_data_main,
+    op_kwargs={'interval': '1m'},
+    dag=intraday_dag,
+)
+
+fetch_intraday_5m = PythonOperator(
+    task_id='fetch_intraday_5m',
+    python_callable=fetch_stock_data_main,
+    op_kwargs={'interval': '5m'},
+    dag=intraday_dag,
+)
+
+# Only the midnight run goes on to retention
+is_daily_maintenance_run = ShortCircuitOperator(
+    task_id='is_daily_maintenance_run',
+    python_callable=lambda data_interval_end, **_: (
+        data_interval_end.hour == 0 and data_interval_end.minute == 0
+    ),
+    dag=intraday_dag,
+)
+
+# Task to downsample and drop expired intraday partitions and pre-create
+# the next days' partitions
+maintain_intraday_storage = PythonOperator(
+    task_id='maintain_intraday_storage',
+    python_callable=intraday_maintenance_main,
+    dag=intraday_dag,
+)
+
+# All intraday writes run in this one DAG (max_active_runs=1) and in
+# sequence, so partition creation and retention never race each other
+create_intraday_tables >> fetch_intraday_1m >> fetch_intraday_5m >> is_daily_maintenance_run >> maintain_intraday_storage
\ No newline at end of file
@@ -5,8 +5,9 @@ Script to fetch stock market data from Yahoo Finance API and store it in Postgre
 import os
 import sys
 import logging
+import io
 import traceback
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 import pandas as pd
 import yfinance as yf
 import psycopg2
@@ -20,6 +21,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger('stock_data_fetcher')
 
+# Intraday bars live in their own range-partitioned tables (one per interval),
+# split into daily UTC partitions so retention is a cheap DROP TABLE.
+INTRADAY_TABLES = {
+    '1m': 'stock_bars_1m',
+    '5m': 'stock_bars_5m',
+}
+
+# How far back each run asks Yahoo Finance for data. Yahoo caps 1m requests
+# at 7 days. Intraday runs resume from the last stored bar, so the 1 day
+# window only bounds the first load and catch-up after an outage.
+LOOKBACK = {
+    '1d': timedelta(days=7),
+    '5m': timedelta(days=1),
+    '1m': timedelta(days=1),
+}
+
+# Length of one intraday bar; the last stored bar is re-fetched on every run
+# because it may still have been in progress when it was loaded.
+BAR_DURATION = {
+    '1m': timedelta(minutes=1),
+    '5m': timedelta(minutes=5),
+}
+
+INTRADAY_COLUMNS = ['symbol', 'ts', 'open', 'high', 'low', 'close', 'volume']
+
 def get_db_connection():
     """
     Create a connection to the PostgreSQL database.
@@ -74,15 +100,95 @@ def create_tables_if_not_exist(conn):
         logger.error(f"Error creating tables: {e}")
         raise
 
-def fetch_stock_data(symbol, start_date, end_date):
+def relation_exists(cur, name):
+    """
+    Check pg_class for a relation without taking any lock on it.
+    """
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", (name,))
+    return cur.fetchone()[0]
+
+def create_intraday_tables(conn):
+    """
+    Create the partitioned intraday tables if they don't exist.
+
+    Existing tables are detected through pg_class first, because on a
+    partitioned table CREATE INDEX IF NOT EXISTS locks every partition
+    before noticing the index is already there.
+    """
+    try:
+        with conn.cursor() as cur:
+            # Intraday bars: no surrogate id or created_at, REAL prices and a
+            # BRIN index on ts, which stays tiny for append-ordered data.
+            for table in INTRADAY_TABLES.values():
+                if relation_exists(cur, table):
+                    continue
+                cur.execute(sql.SQL("""
+                    CREATE TABLE IF NOT EXISTS {table} (
+                        symbol VARCHAR(10) NOT NULL,
+                        ts TIMESTAMPTZ NOT NULL,
+                        open REAL,
+                        high REAL,
+                        low REAL,
+                        close REAL,
+                        volume BIGINT,
+                        PRIMARY KEY (symbol, ts)
+                    ) PARTITION BY RANGE (ts);
+                """).format(table=sql.Identifier(table)))
+                cur.execute(sql.SQL("""
+                    CREATE INDEX IF NOT EXISTS {index} ON {table}
+                    USING BRIN (ts) WITH (pages_per_range = 32);
+                """).format(
+                    index=sql.Identifier(f"{table}_ts_brin"),
+                    table=sql.Identifier(table)
+                ))
+                logger.info(f"Created intraday table {table}")
+            conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error creating intraday tables: {e}")
+        raise
+
+def partition_name(table, day):
+    """
+    Return the name of the daily partition of table holding day.
+    """
+    return f"{table}_p{day.strftime('%Y%m%d')}"
+
+def ensure_partitions(conn, table, days):
+    """
+    Create the daily partitions of an intraday table for the given UTC days.
+
+    Creating a partition locks the parent ACCESS EXCLUSIVE until commit, so
+    existing partitions are skipped and callers should commit right away.
+    Returns the number of partitions created.
+    """
+    created = 0
+    with conn.cursor() as cur:
+        for day in sorted(set(days)):
+            name = partition_name(table, day)
+            if relation_exists(cur, name):
+                continue
+            lower = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+            cur.execute(sql.SQL("""
+                CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {table}
+                FOR VALUES FROM (%s) TO (%s)
+            """).format(
+                partition=sql.Identifier(name),
+                table=sql.Identifier(table)
+            ), (lower, lower + timedelta(days=1)))
+            created += 1
+    return created
+
+def fetch_stock_data(symbol, start_date, end_date, interval='1d'):
     """
     Fetch stock data from Yahoo Finance API.
-    Returns a pandas DataFrame with the stock data.
+    Returns a pandas DataFrame with the stock data. Daily data has a 'date'
+    column, intraday data a UTC 'ts' column.
     """
     try:
-        logger.info(f"Fetching data for {symbol} from {start_date} to {end_date}")
+        logger.info(f"Fetching {interval} data for {symbol} from {start_date} to {end_date}")
         stock = yf.Ticker(symbol)
-        data = stock.history(start=start_date, end=end_date)
+        data = stock.history(start=start_date, end=end_date, interval=interval)
         
         if data.empty:
             logger.warning(f"No data returned for {symbol}")
@@ -92,6 +198,7 @@ def fetch_stock_data(symbol, start_date, end_date):
         data = data.reset_index()
         data.rename(columns={
             'Date': 'date',
+            'Datetime': 'ts',
             'Open': 'open',
             'High': 'high',
             'Low': 'low',
@@ -103,7 +210,11 @@ def fetch_stock_data(symbol, start_date, end_date):
         data['symbol'] = symbol
         
         # Select only the columns we need
-        data = data[['symbol', 'date', 'open', 'high', 'low', 'close', 'volume']]
+        if interval in INTRADAY_TABLES:
+            data['ts'] = data['ts'].dt.tz_convert('UTC')
+            data = data[INTRADAY_COLUMNS]
+        else:
+            data = data[['symbol', 'date', 'open', 'high', 'low', 'close', 'volume']]
         
         return data
     except Exception as e:
@@ -168,20 +279,236 @@ def insert_stock_data(conn, data):
     
     return rows_inserted
 
-def main():
+def copy_intraday_bars(conn, data, interval):
+    """
+    Bulk load intraday bars into the table for interval.
+
+    Rows are streamed with COPY into a temporary staging table and merged
+    into the partitioned table with a single INSERT ... ON CONFLICT.
+    """
+    if data is None or data.empty:
+        logger.warning("No data to insert")
+        return 0
+    
+    table = INTRADAY_TABLES[interval]
+    symbol = data['symbol'].iloc[0]
+    buf = io.StringIO()
+    data[INTRADAY_COLUMNS].to_csv(buf, index=False, header=False, date_format='%Y-%m-%d %H:%M:%S%z')
+    buf.seek(0)
+    
+    try:
+        # Partitions are normally pre-created by the midnight maintenance run;
+        # commit any created here so the parent lock isn't held during COPY
+        ensure_partitions(conn, table, data['ts'].dt.date)
+        conn.commit()
+        
+        with conn.cursor() as cur:
+            cur.execute("""
+                CREATE TEMP TABLE stock_bars_stage (
+                    symbol VARCHAR(10),
+                    ts TIMESTAMPTZ,
+                    open REAL,
+                    high REAL,
+                    low REAL,
+                    close REAL,
+                    volume BIGINT
+                ) ON COMMIT DROP
+            """)
+            cur.copy_expert(
+                "COPY stock_bars_stage (symbol, ts, open, high, low, close, volume) "
+                "FROM STDIN WITH (FORMAT csv)",
+                buf
+            )
+            cur.execute(sql.SQL("""
+                INSERT INTO {table} AS t (symbol, ts, open, high, low, close, volume)
+                SELECT DISTINCT ON (symbol, ts) symbol, ts, open, high, low, close, volume
+                FROM stock_bars_stage
+                WHERE symbol IS NOT NULL AND ts IS NOT NULL
+                ORDER BY symbol, ts
+                ON CONFLICT (symbol, ts)
+                DO UPDATE SET
+                    open = EXCLUDED.open,
+                    high = EXCLUDED.high,
+                    low = EXCLUDED.low,
+                    close = EXCLUDED.close,
+                    volume = EXCLUDED.volume
+                WHERE (t.open, t.high, t.low, t.close, t.volume)
+                    IS DISTINCT FROM
+                    (EXCLUDED.open, EXCLUDED.high, EXCLUDED.low, EXCLUDED.close, EXCLUDED.volume)
+            """).format(table=sql.Identifier(table)))
+            rows_inserted = cur.rowcount
+            
+            cur.execute("""
+                INSERT INTO stock_metadata (symbol, last_updated)
+                VALUES (%s, CURRENT_TIMESTAMP)
+                ON CONFLICT (symbol) 
+                DO UPDATE SET last_updated = CURRENT_TIMESTAMP
+            """, (symbol,))
+            
+            conn.commit()
+            logger.info(f"Inserted or changed {rows_inserted} {interval} bars for {symbol}")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Database error: {e}")
+        raise
+    
+    return rows_inserted
+
+def get_last_bar_time(conn, table, symbol, since):
+    """
+    Return the timestamp of the latest bar stored for symbol at or after
+    since, or None. The lower bound lets Postgres prune old partitions.
+    """
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql.SQL("""
+                SELECT MAX(ts) FROM {table}
+                WHERE symbol = %s AND ts >= %s
+            """).format(table=sql.Identifier(table)), (symbol, since))
+            return cur.fetchone()[0]
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error reading last bar for {symbol}: {e}")
+        raise
+
+def list_partitions(conn, table):
+    """
+    Return (name, day) pairs for the daily partitions of an intraday table.
+    """
+    prefix = f"{table}_p"
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT child.relname
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = %s
+        """, (table,))
+        names = [row[0] for row in cur.fetchall()]
+    
+    partitions = []
+    for name in names:
+        try:
+            day = datetime.strptime(name[len(prefix):], '%Y%m%d').date()
+        except ValueError:
+            continue
+        partitions.append((name, day))
+    return sorted(partitions, key=lambda p: p[1])
+
+def downsample_partition(conn, partition, day, target_table, bucket_seconds):
+    """
+    Roll up the bars of one intraday partition into bucket_seconds bars in
+    target_table. Bars already present in the target are kept as they are.
+    """
+    ensure_partitions(conn, target_table, [day])
+    with conn.cursor() as cur:
+        cur.execute(sql.SQL("""
+            INSERT INTO {target} (symbol, ts, open, high, low, close, volume)
+            SELECT
+                symbol,
+                to_timestamp(floor(extract(epoch FROM ts) / %s) * %s) AS bucket,
+                (array_agg(open ORDER BY ts))[1],
+                MAX(high),
+                MIN(low),
+                (array_agg(close ORDER BY ts DESC))[1],
+                SUM(volume)
+            FROM {source}
+            GROUP BY symbol, bucket
+            ON CONFLICT (symbol, ts) DO NOTHING
+        """).format(
+            target=sql.Identifier(target_table),
+            source=sql.Identifier(partition)
+        ), (bucket_seconds, bucket_seconds))
+        return cur.rowcount
+
+def maintain_intraday_storage(conn, today=None):
+    """
+    Apply retention to the intraday tables.
+
+    Expired 1m partitions are first downsampled into 5m bars, then dropped.
+    Expired 5m partitions are dropped; daily history stays in stock_data.
+    Partitions for today and the next two days are created ahead of time so
+    the loads never have to.
+    """
+    today = today or datetime.now(timezone.utc).date()
+    retention = {
+        '1m': int(os.environ.get("INTRADAY_RETENTION_DAYS_1M", 30)),
+        '5m': int(os.environ.get("INTRADAY_RETENTION_DAYS_5M", 365)),
+    }
+    
+    dropped = 0
+    try:
+        for interval, table in INTRADAY_TABLES.items():
+            cutoff = today - timedelta(days=retention[interval])
+            for partition, day in list_partitions(conn, table):
+                if day >= cutoff:
+                    continue
+                if interval == '1m':
+                    rows = downsample_partition(conn, partition, day, INTRADAY_TABLES['5m'], 300)
+                    logger.info(f"Downsampled {partition} into {rows} 5m bars")
+                with conn.cursor() as cur:
+                    cur.execute(sql.SQL("DROP TABLE IF EXISTS {partition}").format(
+                        partition=sql.Identifier(partition)
+                    ))
+                # Commit per partition so a failure keeps the work already done
+                conn.commit()
+                logger.info(f"Dropped expired partition {partition}")
+                dropped += 1
+            
+            upcoming = [today + timedelta(days=offset) for offset in range(3)]
+            created = ensure_partitions(conn, table, upcoming)
+            conn.commit()
+            logger.info(f"Created {created} upcoming partitions for {table}")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error maintaining intraday storage: {e}")
+        raise
+    
+    return dropped
+
+def maintenance_main():
+    """
+    Entry point for the intraday retention and downsampling job.
+    """
+    conn = get_db_connection()
+    try:
+        return maintain_intraday_storage(conn)
+    finally:
+        conn.close()
+
+def setup_intraday_main():
+    """
+    Entry point for the intraday DAG's setup task. Creates the tables the
+    intraday loads rely on; cheap when they already exist.
+    """
+    conn = get_db_connection()
+    try:
+        create_tables_if_not_exist(conn)
+        create_intraday_tables(conn)
+    finally:
+        conn.close()
+
+def main(interval='1d'):
     """
     Main function to fetch and store stock data.
+    The bar interval is '1d', '5m' or '1m'.
     """
     # Get stock symbols from environment variable
     symbols = os.environ.get("STOCK_SYMBOLS", "AAPL,MSFT,GOOGL").split(",")
+    if interval not in LOOKBACK:
+        raise ValueError(f"Unsupported interval: {interval}")
     
-    # Calculate date range (last 7 days by default)
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=7)
-    
-    # Format dates for Yahoo Finance API
-    start_date_str = start_date.strftime('%Y-%m-%d')
-    end_date_str = end_date.strftime('%Y-%m-%d')
+    # Calculate the fetch window for this interval
+    if interval in INTRADAY_TABLES:
+        # Intraday bars are requested up to the current time
+        end = datetime.now(timezone.utc)
+        start = end - LOOKBACK[interval]
+    else:
+        # Format dates for Yahoo Finance API
+        end_date = datetime.now()
+        start_date = end_date - LOOKBACK[interval]
+        start = start_date.strftime('%Y-%m-%d')
+        end = end_date.strftime('%Y-%m-%d')
     
     try:
         # Get database connection
@@ -196,12 +523,22 @@ def main():
         for symbol in symbols:
             symbol = symbol.strip()
             try:
+                # Resume intraday fetches from the last stored bar
+                symbol_start = start
+                if interval in INTRADAY_TABLES:
+                    last_bar = get_last_bar_time(conn, INTRADAY_TABLES[interval], symbol, start)
+                    if last_bar is not None:
+                        symbol_start = max(start, last_bar - BAR_DURATION[interval])
+                
                 # Fetch data
-                data = fetch_stock_data(symbol, start_date_str, end_date_str)
+                data = fetch_stock_data(symbol, symbol_start, end, interval)
                 
                 # Insert data into database
                 if data is not None and not data.empty:
-                    rows = insert_stock_data(conn, data)
+                    if interval in INTRADAY_TABLES:
+                        rows = copy_intraday_bars(conn, data, interval)
+                    else:
+                        rows = insert_stock_data(conn, data)
                     total_rows_inserted += rows
                 else:
                     logger.warning(f"No data to insert for {symbol}")